@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta
 import csv
-import random
+from html import escape
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 class Month:
-    def __init__(self, doctors, weekends, start_day, num_of_days_in_month, unavailable_sessions_days={}, unavailable_standby_days={}, unavailable_clinic_days=[], holidays=[]):
+    def __init__(self, doctors, weekends, start_day, num_of_days_in_month, unavailable_sessions_days={}, unavailable_standby_days={}, unavailable_clinic_days=[], holidays=[], seed=None):
         """
         Initializes the Month class with a dictionary of doctors, days considered as weekends, and the weekday of the first day of the month.
         :param doctors: dict, a dictionary of doctor names and their types ('regular' or 'special')
@@ -13,164 +14,248 @@ class Month:
         :param start_day: int, the weekday of the first day of the month (0=Sunday, 1=Monday, ..., 6=Saturday)
         :param unavailable_sessions_days, unavailable_standby_days, unavailable_clinic_days: dict, a dictionary where keys are doctor names and values are lists of days they are unavailable
         :param holidays: list, dates of the month that sessions are not scheduled
+        :param seed: int or None, seed for the random generator, for reproducible schedules
         """
         self.doctors = doctors
         self.weekends = weekends
         self.start_day = start_day
+        self.rng = np.random.default_rng(seed)
         self.num_of_days_in_month = num_of_days_in_month+1
-        self.unavailable_sessions_days = unavailable_sessions_days
-        self.unavailable_standby_days = unavailable_standby_days
-        self.unavailable_clinic_days = unavailable_clinic_days
-        self.holidays = holidays
-        self.schedule = {day: None for day in range(1, self.num_of_days_in_month)}
-        self.standby = {day: None for day in range(1, self.num_of_days_in_month)}
-
-    def is_weekday(self, day):
-        # Calculate day of the week for this date
-        day_of_week = (self.start_day + day - 1) % 7
-        return day_of_week not in self.weekends
-
-    def assign_sessions(self):
-        # Gather doctors
-        regulars = [name for name, type_ in self.doctors.items() if type_ == 'regular']
-        specials = [name for name, type_ in self.doctors.items() if type_ == 'special']
-
-        # Set required sessions counts
-        coronary_first = {name: 3 if name == "Hana" else 2 for name in regulars}
-        coronary_second = {name: 2 for name in regulars}
-        tavi_first = {name: 1 for name in regulars}
-        tavi_second = {name: 1 for name in regulars}
-
-        # Filter days for session assignment (only weekdays)
-        days = [i for i in range(1, self.num_of_days_in_month) if self.is_weekday(i)]
-
-        random.shuffle(days)
-        half_point = len(days) // 2
-
-        for i, day in enumerate(days):
-            if day in self.holidays:
+        self.unavailable_clinic_days = frozenset(unavailable_clinic_days)
+        self.holidays = frozenset(holidays)
+        self._doctor_ids = {name: i for i, name in enumerate(doctors)}
+        # Doctors with special rules, resolved once (None when not on the roster)
+        self._hana, self._greenberg, self._katya, self._perl, self._amos = (
+            name if name in doctors else None for name in ("Hana", "Greenberg", "Katya", "Perl", "Amos"))
+        self._regulars = tuple(name for name, type_ in doctors.items() if type_ == 'regular')
+        self._specials = tuple(name for name, type_ in doctors.items() if type_ == 'special')
+        # Greenberg and Katya are only available for sessions, not standbys
+        self._standby_specials = tuple(name for name in self._specials if name not in (self._greenberg, self._katya))
+        self._weekend_mask = 0  # Bit d set when day of week d is a weekend day
+        for weekend_day in weekends:
+            self._weekend_mask |= 1 << weekend_day
+        self._dow = [(start_day + day - 1) % 7 for day in range(self.num_of_days_in_month)]
+        self._weekdays = tuple(day for day in range(1, self.num_of_days_in_month) if self.is_weekday(day))
+        self._fridays = tuple(day for day in range(1, self.num_of_days_in_month) if self._dow[day] == 5)
+        self._saturdays = tuple(day for day in range(1, self.num_of_days_in_month) if self._dow[day] == 6)
+        # Dense (day, doctor id) matrices where 1 means unavailable (row 0 unused)
+        self._regular_ids = np.array([self._doctor_ids[name] for name in self._regulars], dtype=np.intp)
+        self._unavailable_sessions = self._unavailability_matrix(unavailable_sessions_days)
+        self._unavailable_standby = self._unavailability_matrix(unavailable_standby_days)
+        # Regular doctors available on each day; the solvers only have to check quotas against these
+        self._eligible_sessions = self._eligible_regulars(self._unavailable_sessions)
+        self._eligible_standby = self._eligible_regulars(self._unavailable_standby)
+        # Indexed by day of the month (index 0 unused)
+        self.schedule = [None] * self.num_of_days_in_month
+        self.standby = [None] * self.num_of_days_in_month
+        self.max_steps = 20000  # Search budget for each backtracking run
+
+    def _unavailability_matrix(self, unavailable_days):
+        matrix = np.zeros((self.num_of_days_in_month, len(self._doctor_ids)), dtype=np.uint8)
+        for name, days in unavailable_days.items():
+            if name not in self._doctor_ids:
                 continue
-            session_type = 'coronary' if i < half_point else 'TAVI'
-            first, second = (coronary_first, coronary_second) if session_type == 'coronary' else (tavi_first, tavi_second)
+            days = [day for day in days if 0 < day < self.num_of_days_in_month]
+            matrix[days, self._doctor_ids[name]] = 1
+        return matrix
 
-            first_candidates = [doc for doc in first if first[doc] > 0]
-            second_candidates = [doc for doc in second if second[doc] > 0]
+    def _eligible_regulars(self, unavailable):
+        available = unavailable[:, self._regular_ids] == 0
+        return [tuple(self._regulars[i] for i in np.nonzero(row)[0]) for row in available]
 
-            if not first_candidates or not second_candidates:
-                continue
-
-            chosen_first, chosen_second = None, None
-            while chosen_first == None or chosen_second == None:
-                first_candidate = random.choice(first_candidates)
-                second_candidate = None#random.choice([doc for doc in second_candidates if doc != chosen_first])
+    def is_weekday(self, day):
+        return not (self._weekend_mask >> self._dow[day]) & 1
 
-                attempts = 0
-                while True:
-                    second_candidate = random.choice(second_candidates)
-                    if (second_candidate != chosen_first and second_candidate != first_candidate) or attempts > 1000:
+    def _backtrack(self, domains, capacity, required):
+        """
+        Finds one assignment of a value to every variable by backtracking search with the minimum-remaining-values
+        heuristic and forward checking. Stops at the first feasible assignment or after self.max_steps assignments.
+        :param domains: dict, variable -> list of (value, uses) pairs in the order they should be tried, where uses is a list of the resources the value consumes
+        :param capacity: dict, resource -> maximum number of units the whole assignment may consume
+        :param required: dict, resource -> minimum number of units the whole assignment must consume
+        :return: dict, variable -> value, or None if no assignment was found
+        """
+        steps = 0
+
+        def fits(uses, remaining):
+            return all(uses.count(resource) <= remaining.get(resource, 0) for resource in uses if resource in capacity)
+
+        def search(assignment, domains, remaining):
+            nonlocal steps
+            if not domains:
+                return assignment
+            var = min(domains, key=lambda v: len(domains[v]))
+            others = [v for v in domains if v != var]
+            for value, uses in domains[var]:
+                steps += 1
+                if steps > self.max_steps:
+                    return None
+                new_remaining = dict(remaining)
+                for resource in uses:
+                    if resource in new_remaining:
+                        new_remaining[resource] -= 1
+
+                # Forward checking: drop values that no longer fit, fail early on an empty domain
+                pruned = {}
+                for other in others:
+                    pruned[other] = [(v, u) for v, u in domains[other] if fits(u, new_remaining)]
+                    if not pruned[other]:
                         break
-                    attempts += 1
-
-                if chosen_first == None:
-                    if day not in self.unavailable_sessions_days.get(first_candidate, []):
-                        chosen_first = first_candidate
+                else:
+                    # Every required resource must still be reachable by the unassigned variables
+                    if all(required[resource] - (capacity[resource] - new_remaining[resource])
+                           <= sum(max((u.count(resource) for _, u in pruned[other]), default=0) for other in others)
+                           for resource in required):
+                        result = search({**assignment, var: value}, pruned, new_remaining)
+                        if result is not None:
+                            return result
+                if steps > self.max_steps:
+                    return None
+            return None
+
+        return search({}, domains, dict(capacity))
 
-                if chosen_second == None:
-                    if day not in self.unavailable_sessions_days.get(second_candidate, []):
-                        chosen_second = second_candidate
+    def assign_sessions(self):
+        regulars = self._regulars
 
-            self.schedule[day] = (session_type, chosen_first, chosen_second)
-            first[chosen_first] -= 1
-            second[chosen_second] -= 1
+        # Set required sessions counts
+        quotas = {
+            ('coronary', 'first'): {name: 3 if name == self._hana else 2 for name in regulars},
+            ('coronary', 'second'): {name: 2 for name in regulars},
+            ('TAVI', 'first'): {name: 1 for name in regulars},
+            ('TAVI', 'second'): {name: 1 for name in regulars},
+        }
+        capacity = {(session_type, role, name): count for (session_type, role), counts in quotas.items() for name, count in counts.items()}
+        # Every session needs one first and one second doctor, so the smaller pool bounds the number of sessions
+        required = {(session_type, 'sessions'): min(sum(quotas[session_type, 'first'].values()), sum(quotas[session_type, 'second'].values()))
+                    for session_type in ('coronary', 'TAVI')}
+        capacity.update(required)
+
+        # Sessions are only held on weekdays that are not holidays; shuffling spreads them over the month
+        days = [day for day in self._weekdays if day not in self.holidays]
+        self.rng.shuffle(days)
+
+        domains = {}
+        for day in days:
+            available = self._eligible_sessions[day]
+            values = [((session_type, first, second), [(session_type, 'first', first), (session_type, 'second', second), (session_type, 'sessions')])
+                      for session_type in ('coronary', 'TAVI') for first in available for second in available if first != second]
+            self.rng.shuffle(values)
+            values.append((None, []))  # No session on this day
+            domains[day] = values
+
+        solution = self._backtrack(domains, capacity, required)
+        if solution is None:
+            # The quotas cannot all be met, settle for as many sessions as the first feasible assignment gives
+            solution = self._backtrack(domains, capacity, {})
+
+        for day, session in solution.items():
+            if session is not None:
+                self.schedule[day] = session
 
     def assign_standby(self):
-        # Gather doctor types
-        regulars = [name for name, type_ in self.doctors.items() if type_ == 'regular']
-        specials = [name for name, type_ in self.doctors.items() if type_ == 'special']
-        specials.remove("Greenberg") # Greenberg only available for sessions, not standbys
-        specials.remove("Katya") # Katya only available for sessions, not standbys
+        regulars = self._regulars
+        eligible = self._eligible_standby
+        hana = self._hana
 
         # Initialize the standby requirement counts
-        standby_counts = {name: 5 for name in regulars}
-        standby_counts["Hana"] = 4  # Hana prefers only one Saturday
-
-        # Assign weekends first for regular doctors
-        saturdays = [i for i in range(1, self.num_of_days_in_month) if (self.start_day + i - 1) % 7 == 6]
-        fridays = [i for i in range(1, self.num_of_days_in_month) if (self.start_day + i - 1) % 7 == 5]
-
-        # Assign Hana to one Saturday if possible
-        if saturdays:
-            for i, saturday in enumerate(saturdays):
-                if not saturday in self.unavailable_standby_days.get("Hana", []):
-                    self.standby[saturdays[i]] = "Hana"
-                    standby_counts["Hana"] -= 1
-                    saturdays.pop(i)
-                    break
-
-        # Assign other doctors to full weekends
-        for friday, saturday in zip(fridays, saturdays):
-            for name in regulars:
-                if name == "Hana":
-                    continue  # Skip Hana for additional Saturdays
-                if standby_counts[name] >= 2 and friday not in self.unavailable_standby_days.get(name, []) and saturday not in self.unavailable_standby_days.get(name, []):
-                    self.standby[friday] = name
-                    self.standby[saturday] = name
-                    standby_counts[name] -= 2
-                    break
-
-        # Assign remaining standby shifts on weekdays
-        weekdays = [i for i in range(1, self.num_of_days_in_month) if self.is_weekday(i)]
-        for day in weekdays:
-            random.shuffle(regulars)
-            if all(count <= 0 for count in standby_counts.values()):
-                break  # Stop if all standby requirements are met
-            for name in regulars:
-                if standby_counts[name] > 0 and self.standby[day] is None and day not in self.unavailable_standby_days.get(name, []):
-                    self.standby[day] = name
-                    standby_counts[name] -= 1
-                    break
+        # Hana prefers only one Saturday, which counts towards Hana's 4
+        standby_counts = {name: 4 if name == hana else 5 for name in regulars}
+        capacity = dict(standby_counts)
+        if hana is not None:
+            capacity[(hana, "Saturday")] = 1
+        required = dict(standby_counts)
+
+        # Group days into blocks: full weekends (a Friday and the Saturday right after it) and single days
+        weekends = [(friday, friday + 1) for friday in self._fridays if friday + 1 < self.num_of_days_in_month]
+        weekend_days = {day for weekend in weekends for day in weekend}
+        blocks = weekends + [(day,) for day in range(1, self.num_of_days_in_month) if day not in weekend_days]
+
+        domains = {}
+        for block in blocks:
+            values = []
+            if len(block) == 2:
+                # Regular doctors other than Hana take full weekends
+                friday, saturday = block
+                values += [((name, name), [name, name]) for name in eligible[friday] if name != hana and name in eligible[saturday]]
+            elif self.is_weekday(block[0]):
+                values += [((name,), [name]) for name in eligible[block[0]]]
+            self.rng.shuffle(values)
+            # Hana may take a single Saturday, leaving the Friday to a special doctor
+            saturday = block[-1]
+            if self._dow[saturday] == 6 and hana is not None and hana in eligible[saturday]:
+                values.append(((None,) * (len(block) - 1) + (hana,), [hana, (hana, "Saturday")]))
+                required[(hana, "Saturday")] = 1
+            values.append(((None,) * len(block), []))  # Left to special doctors
+            domains[block] = values
+
+        solution = self._backtrack(domains, capacity, required)
+        if solution is None:
+            # The standby counts cannot all be met, settle for the first feasible assignment
+            solution = self._backtrack(domains, capacity, {})
+
+        for block, names in solution.items():
+            for day, name in zip(block, names):
+                self.standby[day] = name
 
         # Fill in any remaining slots with special doctors as needed
-        for day in range(1, self.num_of_days_in_month):
-            if self.standby[day] is None:
-                self.standby[day] = random.choice(specials)
+        missing_days = [day for day in range(1, self.num_of_days_in_month) if self.standby[day] is None]
+        picks = self.rng.integers(len(self._standby_specials), size=len(missing_days))
+        for day, pick in zip(missing_days, picks):
+            self.standby[day] = self._standby_specials[pick]
 
-
-    def generate_schedule(self):
+    def solve(self):
         self.assign_sessions()
         self.assign_standby()
 
-        clinic_days = random.sample([day for day in range(1, self.num_of_days_in_month) if self.is_weekday(day) if day not in self.unavailable_clinic_days], 3)
-        clinic_assignments = {}
-        count = {'Perl': 0, 'Amos': 0}
-        for day in clinic_days:
-            if count['Perl'] == count['Amos']:
-                chosen = random.choice(['Perl', 'Amos'])
-            elif count['Perl'] < count['Amos']:
-                chosen = 'Perl'
-            else:
-                chosen = 'Amos'
-            clinic_assignments[day] = chosen
-            count[chosen] += 1
-        rows = []
-
-        for day in range(1, self.num_of_days_in_month):
-            session_info = self.schedule.get(day)
-            standby_doctor = self.standby.get(day)
-            clinic_doctor = clinic_assignments.get(day, '')  # Get clinic doctor if assigned, else 'None'
-            
+    def generate_columns(self):
+        self.solve()
+
+        clinic_candidates = np.array([day for day in self._weekdays if day not in self.unavailable_clinic_days])
+        clinic_days = self.rng.choice(clinic_candidates, size=3, replace=False).tolist()
+        # Alternating pattern keeps Perl and Amos within one clinic of each other; if only one is on the roster they take all three
+        clinicians = [name for name in (self._perl, self._amos) if name is not None]
+        self.rng.shuffle(clinicians)
+        base = (clinicians * 3)[:3]
+        clinic_assignments = dict(zip(clinic_days, base))
+
+        num_of_days = self.num_of_days_in_month - 1
+        days = list(range(1, self.num_of_days_in_month))
+        session_types, first_doctors, second_doctors = [''] * num_of_days, [''] * num_of_days, [''] * num_of_days
+        standby_doctors, clinic_doctors = [''] * num_of_days, [''] * num_of_days
+
+        for i, day in enumerate(days):
+            session_info = self.schedule[day]
             if session_info:
-                # Extract session type and doctors assigned to the session
-                session_type, first_doctor, second_doctor = session_info
-            else:
-                # If no session is scheduled, write empty placeholders
-                session_type, first_doctor, second_doctor = '', '', ''
-            
-            # Write the day's schedule to the file
-            rows.append([day, session_type, first_doctor, second_doctor, standby_doctor or '', clinic_doctor])
-        
-        df = pd.DataFrame(rows, columns=['Day', 'Session Type', 'First Doctor', 'Second Doctor', 'Standby Doctor', 'Clinic'])
-        return df
+                # Extract session type and doctors assigned to the session; days without one keep empty placeholders
+                session_types[i], first_doctors[i], second_doctors[i] = session_info
+            standby_doctors[i] = self.standby[day] or ''
+            clinic_doctors[i] = clinic_assignments.get(day, '')  # Get clinic doctor if assigned, else ''
+
+        return {'Day': days, 'Session Type': session_types, 'First Doctor': first_doctors,
+                'Second Doctor': second_doctors, 'Standby Doctor': standby_doctors, 'Clinic': clinic_doctors}
+
+    def generate_schedule(self):
+        return pd.DataFrame(self.generate_columns())
+
+def columns_to_html(columns):
+    """
+    Renders schedule columns (as returned by Month.generate_columns) as an HTML table, without going through pandas.
+    """
+    header = ''.join(f'<th>{escape(name)}</th>' for name in columns)
+    body = ''.join('<tr>' + ''.join(f'<td>{escape(str(cell))}</td>' for cell in row) + '</tr>' for row in zip(*columns.values()))
+    return f'<table border="1" class="dataframe"><thead><tr style="text-align: right;">{header}</tr></thead><tbody>{body}</tbody></table>'
+
+@st.cache_data
+def build_schedule(doctors_t, weekends_t, start_day, num_of_days_in_month, unavailable_sessions_t, unavailable_standby_t, unavailable_clinic_t, holidays_t, seed):
+    """
+    Generates the schedule as an HTML table, cached by the (hashable) inputs so unchanged reruns skip regeneration.
+    Dict inputs are passed as tuples of (name, days) pairs; seed makes the random assignment reproducible.
+    """
+    month = Month(doctors=dict(doctors_t), weekends=list(weekends_t), start_day=start_day, num_of_days_in_month=num_of_days_in_month,
+                  unavailable_sessions_days=dict(unavailable_sessions_t), unavailable_standby_days=dict(unavailable_standby_t),
+                  unavailable_clinic_days=unavailable_clinic_t, holidays=holidays_t, seed=seed)
+    return columns_to_html(month.generate_columns())
 
 ### App
 st.title('Doctors Schedule Generator')
@@ -214,10 +299,11 @@ for doctor in doctors:
 
 unavailable_clinic_days = cols[0].multiselect("Unavailable clinic days:", range(1, num_of_days_in_month+1), key="clinic")
 holidays = cols[1].multiselect("Enter holidays:", range(1, num_of_days_in_month+1), key="holidays")
+seed = cols[0].number_input('Random seed (change it to get a different schedule)', min_value=0, value=0)
 
 if st.button('Generate Schedule'):
-    month = Month(doctors=doctors, weekends=[5, 6], start_day=start_day_num, num_of_days_in_month=num_of_days_in_month, unavailable_sessions_days=unavailable_sessions_days, unavailable_standby_days=unavailable_standby_days, unavailable_clinic_days=unavailable_clinic_days, holidays=holidays)
-    df = month.generate_schedule()
-
-    html = df.to_html(index=False)
+    html = build_schedule(tuple(doctors.items()), (5, 6), start_day_num, num_of_days_in_month,
+                          tuple((name, tuple(days)) for name, days in unavailable_sessions_days.items()),
+                          tuple((name, tuple(days)) for name, days in unavailable_standby_days.items()),
+                          tuple(unavailable_clinic_days), tuple(holidays), seed)
     st.markdown(html, unsafe_allow_html=True)